@@ -22,6 +22,10 @@
 import logging
 import re
 
+# Precompile BDF patterns once at import instead of on every cast/compare
+_BDF_SEPARATOR_RE = re.compile(r'[:.]')
+_BDF_VALIDATION_RE = re.compile(r"(?:[0-6]?[0-9a-fA-F]{1,4}:)?[0-2]?[0-9a-fA-F]{1,2}:[0-9a-fA-F]{1,2}\.[0-7]")
+
 
 class BDF():
     """ BDF Class to cast and compare BDF objects using built-in python comparators
@@ -42,7 +46,7 @@ class BDF():
                 bdf = bdf.replace('BDF(', '').replace(')', '')
 
             try:
-                bdf_components = [int(x, 16) for x in re.split('[:.]', bdf)]
+                bdf_components = [int(x, 16) for x in _BDF_SEPARATOR_RE.split(bdf)]
             except self.BDFError as e:
                 logging.error(f"Invalid string passed: {bdf}")
                 raise e
@@ -123,8 +127,7 @@ class BDF():
         """Overrided the 'in' comparator in python"""
         passed_bdf = str(BDF(passed_bdf))
 
-        bdf_regex = "(?:[0-6]?[0-9a-fA-F]{1,4}:)?[0-2]?[0-9a-fA-F]{1,2}:[0-9a-fA-F]{1,2}\.[0-7]"
-        for match in re.findall(bdf_regex, passed_bdf):
+        for match in _BDF_VALIDATION_RE.findall(passed_bdf):
             if self == match:
                 return True
         return False
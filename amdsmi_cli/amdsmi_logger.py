@@ -20,17 +20,27 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-import csv
+import io
 import json
-import re
+import sys
 import time
 from typing import Dict
 from enum import Enum
-import yaml
 
 from amdsmi_helpers import AMDSMIHelpers
 import amdsmi_cli_exceptions
 
+# Serialize through orjson's C encoder when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Device keys emitted at the top level of human readable output
+_DEVICE_KEYS = frozenset({"GPU", "CPU", "CORE"})
+# Parent keys whose children are flattened without the parent prefix
+_UNPREFIXED_PARENT_KEYS = frozenset({'gfx'})
+
 class AMDSMILogger():
     def __init__(self, format='human_readable', destination='stdout') -> None:
         self.output = {}
@@ -41,6 +51,7 @@ class AMDSMILogger():
         self.table_header = ""
         self.table_title = ""
         self.helpers = AMDSMIHelpers()
+        self._watch_file = None # File handle reused across watch flushes
 
 
     class LoggerFormat(Enum):
@@ -52,130 +63,191 @@ class AMDSMILogger():
 
     class CsvStdoutBuilder(object):
         def __init__(self):
-            self.csv_string = []
+            self.csv_string = io.StringIO()
 
         def write(self, row):
-            self.csv_string.append(row)
+            self.csv_string.write(row)
 
         def __str__(self):
-            return ''.join(self.csv_string)
+            return self.csv_string.getvalue()
+
+
+    @property
+    def format(self):
+        return self._format
+
+
+    @format.setter
+    def format(self, new_format):
+        # Cache the format comparisons so the per-call is_*_format checks
+        # don't re-compare enum values on every store/print
+        self._format = new_format
+        self._is_json = new_format == self.LoggerFormat.json.value
+        self._is_csv = new_format == self.LoggerFormat.csv.value
+        self._is_human_readable = new_format == self.LoggerFormat.human_readable.value
+
+        # Bind the store handler for the format once instead of re-branching
+        # on the format inside every store call
+        if self._is_json or self._is_human_readable:
+            self._store_entry = self._store_entry_nested
+        elif self._is_csv:
+            self._store_entry = self._store_entry_flat
+        else:
+            self._store_entry = self._store_entry_invalid
 
 
     def is_json_format(self):
-        return self.format == self.LoggerFormat.json.value
+        return self._is_json
 
 
     def is_csv_format(self):
-        return self.format == self.LoggerFormat.csv.value
+        return self._is_csv
 
 
     def is_human_readable_format(self):
-        return self.format == self.LoggerFormat.human_readable.value
+        return self._is_human_readable
 
     def clear_multiple_devices_ouput(self):
         self.multiple_device_output.clear()
 
     def _capitalize_keys(self, input_dict):
         output_dict = {}
-        for key in input_dict.keys():
-            # Capitalize key if it is a string
-            if isinstance(key, str):
-                cap_key = key.upper()
-            else:
-                cap_key = key
-
-            if isinstance(input_dict[key], dict):
-                output_dict[cap_key] = self._capitalize_keys(input_dict[key])
-            elif isinstance(input_dict[key], list):
-                cap_key_list = []
-                for data in input_dict[key]:
-                    if isinstance(data, dict):
-                        cap_key_list.append(self._capitalize_keys(data))
-                    else:
-                        cap_key_list.append(data)
-                output_dict[cap_key] = cap_key_list
-            else:
-                output_dict[cap_key] = input_dict[key]
+        # Walk the dictionary iteratively, pairing each source dict with the
+        # destination dict being built for it
+        stack = [(input_dict, output_dict)]
+        while stack:
+            source_dict, destination_dict = stack.pop()
+            # Leaf dicts with no nested containers are the common case; build
+            # them with a single comprehension instead of the per-key branch
+            if not any(isinstance(value, (dict, list)) for value in source_dict.values()):
+                destination_dict.update(
+                    {sys.intern(key.upper()) if isinstance(key, str) else key: value
+                     for key, value in source_dict.items()})
+                continue
+            for key, value in source_dict.items():
+                # Capitalize key if it is a string
+                if isinstance(key, str):
+                    # Interned so every device shares one copy of each derived key
+                    cap_key = sys.intern(key.upper())
+                else:
+                    cap_key = key
+
+                if isinstance(value, dict):
+                    destination_dict[cap_key] = child_dict = {}
+                    stack.append((value, child_dict))
+                elif isinstance(value, list):
+                    cap_key_list = []
+                    for data in value:
+                        if isinstance(data, dict):
+                            child_dict = {}
+                            cap_key_list.append(child_dict)
+                            stack.append((data, child_dict))
+                        else:
+                            cap_key_list.append(data)
+                    destination_dict[cap_key] = cap_key_list
+                else:
+                    destination_dict[cap_key] = value
 
         return output_dict
 
 
+    def _format_human_readable_value(self, value):
+        # Match the json style literals the human readable output has always used
+        if value is None:
+            return 'null'
+        if value is True:
+            return 'true'
+        if value is False:
+            return 'false'
+        if isinstance(value, dict):
+            return '{}'
+        if isinstance(value, list):
+            return '[]'
+        return str(value)
+
+
+    def _emit_human_readable(self, obj, indent, out_list):
+        """ Recursively emit a capitalized dictionary as indented key: value lines
+            params:
+                obj (dict | list) - Object to emit
+                indent (int) - Number of spaces to indent the current level
+                out_list (list) - List of emitted lines to join once at the end
+            return:
+                Nothing
+        """
+        spacing = ' ' * indent
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if isinstance(value, (dict, list)) and value:
+                    out_list.append(f"{spacing}{key}:\n")
+                    self._emit_human_readable(value, indent + 4, out_list)
+                else:
+                    out_list.append(f"{spacing}{key}: {self._format_human_readable_value(value)}\n")
+        elif isinstance(obj, list):
+            for item in obj:
+                if isinstance(item, (dict, list)) and item:
+                    self._emit_human_readable(item, indent, out_list)
+                else:
+                    out_list.append(f"{spacing}{self._format_human_readable_value(item)}\n")
+
+
     def _convert_json_to_human_readable(self, json_object: Dict[str, any], tabular=False):
         # TODO make dynamic
         if tabular:
-            table_values = ''
+            table_values = []
             for key, value in json_object.items():
                 value = str(value)
                 if key == 'gpu':
-                    table_values += value.rjust(3)
+                    table_values.append(value.rjust(3))
                 elif key == 'timestamp':
-                    table_values += value.rjust(10) + '  '
+                    table_values.append(value.rjust(10) + '  ')
                 elif key == 'power_usage':
-                    table_values += value.rjust(7)
+                    table_values.append(value.rjust(7))
                 elif key in ('gfx_clock', 'mem_clock', 'encoder_clock', 'decoder_clock', 'vram_used'):
-                    table_values += value.rjust(11)
+                    table_values.append(value.rjust(11))
                 elif key == 'vram_total' or 'ecc' in key:
-                    table_values += value.rjust(12)
+                    table_values.append(value.rjust(12))
                 elif key in ('throttle_status', 'pcie_replay'):
-                    table_values += value.rjust(13)
+                    table_values.append(value.rjust(13))
                 # Only for handling topology tables
                 elif 'gpu_' in key:
-                    table_values += value.ljust(13)
+                    table_values.append(value.ljust(13))
                 # Only for handling xgmi tables
                 elif key == "gpu#":
-                    table_values += value.ljust(7)
+                    table_values.append(value.ljust(7))
                 elif key == "bdf":
-                    table_values += value.ljust(13)
+                    table_values.append(value.ljust(13))
                 elif "bdf_" in key:
-                    table_values += value.ljust(13)
+                    table_values.append(value.ljust(13))
                 elif key == "bit_rate":
-                    table_values += value.ljust(9)
+                    table_values.append(value.ljust(9))
                 elif key == "max_bandwidth":
-                    table_values += value.ljust(14)
+                    table_values.append(value.ljust(14))
                 elif key == "link_type":
-                    table_values += value.ljust(10)
+                    table_values.append(value.ljust(10))
                 elif key == "RW":
-                    table_values += " " + value.ljust(52)
+                    table_values.append(" " + value.ljust(52))
                 # Default spacing
                 else:
-                    table_values += value.rjust(10)
-            return table_values.rstrip()
+                    table_values.append(value.rjust(10))
+            return ''.join(table_values).rstrip()
 
         # First Capitalize all keys in the json object
         capitalized_json = self._capitalize_keys(json_object)
 
-        # Increase tabbing for device arguments by pulling them out of the main dictionary and assiging them to an empty string
+        # Emit device keys at the top level and increase tabbing for device arguments
+        # by pulling them into a separate dictionary emitted afterwards
+        out_list = []
         tabbed_dictionary = {}
         for key, value in capitalized_json.items():
-            if key not in ["GPU", "CPU", "CORE"]:
+            if key in _DEVICE_KEYS:
+                self._emit_human_readable({key: value}, 0, out_list)
+            else:
                 tabbed_dictionary[key] = value
 
-        for key, value in tabbed_dictionary.items():
-            del capitalized_json[key]
-
-        capitalized_json["AMDSMI_SPACING_REMOVAL"] = tabbed_dictionary
+        self._emit_human_readable(tabbed_dictionary, 4, out_list)
 
-        json_string = json.dumps(capitalized_json, indent=4)
-        yaml_data = yaml.safe_load(json_string)
-        yaml_output = yaml.dump(yaml_data, sort_keys=False, allow_unicode=True)
-
-        # Remove a key line if it is a spacer
-        yaml_output = yaml_output.replace("AMDSMI_SPACING_REMOVAL:\n", "")
-        yaml_output = yaml_output.replace("'", "") # Remove ''
-
-        clean_yaml_output = ''
-        for line in yaml_output.splitlines():
-            line = line.split(':')
-
-            # Remove dashes and increase tabbing split key
-            line[0] = line[0].replace("-", " ", 1)
-            line[0] = line[0].replace("  ", "    ")
-
-            # Join cleaned output
-            line = ':'.join(line) + '\n'
-            clean_yaml_output += line
-
-        return clean_yaml_output
+        return ''.join(out_list)
 
 
     def flatten_dict(self, target_dict, topology_override=False):
@@ -200,35 +272,37 @@ class AMDSMILogger():
             target_dict (dict): Dictionary to flatten
             parent_key (str):
         """
-        # print(target_dict)
         output_dict = {}
-        # First flatten out values
-
-        # separetly handle ras and process and firmware
-
-        # If there are multi values, and the values are all dicts
-        # Then flatten the sub values with parent key
-        for key, value in target_dict.items():
+        # Walk the dictionary iteratively instead of recursing per nested dict;
+        # items are pushed in reverse so they pop in their original order
+        # The topology override only applies to the top level entries
+        stack = [(key, value, topology_override)
+                 for key, value in reversed(list(target_dict.items()))]
+        while stack:
+            key, value, override = stack.pop()
             if isinstance(value, dict):
-                # Check number of items in the dict
-                if len(value.values()) > 1 or topology_override:
+                # If there are multi values, and the values are all dicts
+                # Then flatten the sub values with parent key
+                if len(value.values()) > 1 or override:
                     value_with_parent_key = {}
                     for parent_key, child_dict in value.items():
                         if isinstance(child_dict, dict):
-                            if parent_key in ('gfx'):
+                            if parent_key in _UNPREFIXED_PARENT_KEYS:
                                 for child_key, value1 in child_dict.items():
                                     value_with_parent_key[child_key] = value1
                             else:
                                 for child_key, value1 in child_dict.items():
-                                    value_with_parent_key[parent_key + '_' + child_key] = value1
+                                    # Interned so every device shares one copy of each derived key
+                                    value_with_parent_key[sys.intern(f'{parent_key}_{child_key}')] = value1
                         else:
-                            if topology_override:
-                                value_with_parent_key[key + '_' + parent_key] = child_dict
+                            if override:
+                                value_with_parent_key[sys.intern(f'{key}_{parent_key}')] = child_dict
                             else:
                                 value_with_parent_key[parent_key] = child_dict
                     value = value_with_parent_key
 
-                output_dict.update(self.flatten_dict(value).items())
+                for child_key, child_value in reversed(list(value.items())):
+                    stack.append((child_key, child_value, False))
             else:
                 output_dict[key] = value
         return output_dict
@@ -273,70 +347,52 @@ class AMDSMILogger():
         self._store_core_output_amdsmi(core_id=core_id, argument=argument, data=data)
 
 
-    def _store_core_output_amdsmi(self, core_id, argument, data):
-        if argument == 'timestamp': # Make sure timestamp is the first element in the output
-            self.output['timestamp'] = int(time.time())
+    def _store_entry_nested(self, device_key, device_id, argument, data):
+        """ Store one entry as-is for the json and human_readable formats"""
+        self.output[device_key] = device_id
+        if argument == 'values' and isinstance(data, dict):
+            self.output.update(data)
+        else:
+            self.output[argument] = data
+
 
-        if self.is_json_format() or self.is_human_readable_format():
-            self.output['core'] = int(core_id)
-            if argument == 'values' and isinstance(data, dict):
+    def _store_entry_flat(self, device_key, device_id, argument, data):
+        """ Store one entry flattened for the csv format"""
+        self.output[device_key] = device_id
+        if argument == 'values' or isinstance(data, dict):
+            if isinstance(data, dict) and not any(isinstance(value, dict) for value in data.values()):
+                # Already flat, skip the flatten pass
                 self.output.update(data)
             else:
-                self.output[argument] = data
-        elif self.is_csv_format():
-            self.output['core'] = int(core_id)
-
-            if argument == 'values' or isinstance(data, dict):
                 flat_dict = self.flatten_dict(data)
                 self.output.update(flat_dict)
-            else:
-                self.output[argument] = data
         else:
-            raise amdsmi_cli_exceptions(self, "Invalid output format given, only json, csv, and human_readable supported")
+            self.output[argument] = data
 
 
-    def _store_cpu_output_amdsmi(self, cpu_id, argument, data):
+    def _store_entry_invalid(self, device_key, device_id, argument, data):
+        raise amdsmi_cli_exceptions(self, "Invalid output format given, only json, csv, and human_readable supported")
+
+
+    def _store_core_output_amdsmi(self, core_id, argument, data):
         if argument == 'timestamp': # Make sure timestamp is the first element in the output
             self.output['timestamp'] = int(time.time())
 
-        if self.is_json_format() or self.is_human_readable_format():
-            self.output['cpu'] = int(cpu_id)
-            if argument == 'values' and isinstance(data, dict):
-                self.output.update(data)
-            else:
-                self.output[argument] = data
-        elif self.is_csv_format():
-            self.output['cpu'] = int(cpu_id)
+        self._store_entry('core', int(core_id), argument, data)
 
-            if argument == 'values' or isinstance(data, dict):
-                flat_dict = self.flatten_dict(data)
-                self.output.update(flat_dict)
-            else:
-                self.output[argument] = data
-        else:
-            raise amdsmi_cli_exceptions(self, "Invalid output format given, only json, csv, and human_readable supported")
+
+    def _store_cpu_output_amdsmi(self, cpu_id, argument, data):
+        if argument == 'timestamp': # Make sure timestamp is the first element in the output
+            self.output['timestamp'] = int(time.time())
+
+        self._store_entry('cpu', int(cpu_id), argument, data)
 
 
     def _store_output_amdsmi(self, gpu_id, argument, data):
         if argument == 'timestamp': # Make sure timestamp is the first element in the output
             self.output['timestamp'] = int(time.time())
 
-        if self.is_json_format() or self.is_human_readable_format():
-            self.output['gpu'] = int(gpu_id)
-            if argument == 'values' and isinstance(data, dict):
-                self.output.update(data)
-            else:
-                self.output[argument] = data
-        elif self.is_csv_format():
-            self.output['gpu'] = int(gpu_id)
-
-            if argument == 'values' or isinstance(data, dict):
-                flat_dict = self.flatten_dict(data)
-                self.output.update(flat_dict)
-            else:
-                self.output[argument] = data
-        else:
-            raise amdsmi_cli_exceptions(self, "Invalid output format given, only json, csv, and human_readable supported")
+        self._store_entry('gpu', int(gpu_id), argument, data)
 
 
     def _store_output_rocmsmi(self, gpu_id, argument, data):
@@ -363,11 +419,7 @@ class AMDSMILogger():
         """
         if not self.output:
             return
-        output = {}
-        for key, value in self.output.items():
-            output[key] = value
-
-        self.multiple_device_output.append(output)
+        self.multiple_device_output.append(self.output)
         self.output = {}
 
 
@@ -379,17 +431,10 @@ class AMDSMILogger():
                 Nothing
         """
         if multiple_device_enabled:
-            for output in self.multiple_device_output:
-                self.watch_output.append(output)
-
+            self.watch_output.extend(self.multiple_device_output)
             self.multiple_device_output = []
         else:
-            output = {}
-
-            for key, value in self.output.items():
-                output[key] = value
-            self.watch_output.append(output)
-
+            self.watch_output.append(self.output)
             self.output = {}
 
 
@@ -414,6 +459,37 @@ class AMDSMILogger():
                                               tabular=tabular)
 
 
+    def _get_watch_file(self, newline=None):
+        """ Open the watch destination file once and reuse the handle,
+                rewinding it so each flush rewrites the accumulated output
+            params:
+                newline (str) - newline argument for the underlying open
+            return:
+                file handle positioned at the start of an empty file
+        """
+        if self._watch_file is None:
+            self._watch_file = self.destination.open('w', newline=newline)
+        else:
+            self._watch_file.seek(0)
+            self._watch_file.truncate()
+        return self._watch_file
+
+
+    def _dump_json(self, json_output, output_file):
+        """ Serialize json_output to output_file through orjson when installed,
+                falling back to the stdlib streaming encoder
+            params:
+                json_output (dict | list) - Object to serialize
+                output_file - Writable text stream for the serialized output
+            return:
+                Nothing
+        """
+        if orjson is not None:
+            output_file.write(orjson.dumps(json_output, option=orjson.OPT_INDENT_2).decode('utf-8'))
+        else:
+            json.dump(json_output, output_file, indent=4)
+
+
     def _print_json_output(self, multiple_device_enabled=False, watching_output=False):
         if multiple_device_enabled:
             json_output = self.multiple_device_output
@@ -422,18 +498,40 @@ class AMDSMILogger():
 
         if self.destination == 'stdout':
             if json_output:
-                json_std_output = json.dumps(json_output, indent=4)
-                print(json_std_output)
+                # Stream straight to stdout instead of building the full string first
+                self._dump_json(json_output, sys.stdout)
+                print()
         else: # Write output to file
-            if watching_output: # Flush the full JSON output to the file on watch command completion
-                with self.destination.open('w') as output_file:
-                    json.dump(self.watch_output, output_file, indent=4)
+            if watching_output: # Flush the full JSON output to the file
+                output_file = self._get_watch_file()
+                self._dump_json(self.watch_output, output_file)
+                output_file.flush()
             else:
                 with self.destination.open('a') as output_file:
-                    json.dump(json_output, output_file, indent=4)
+                    self._dump_json(json_output, output_file)
+
+
+    def _fill_missing_csv_keys(self, csv_output):
+        """ Backfill keys missing from individual rows with N/A so every row
+                matches the header
+            params:
+                csv_output (list) - List of output dictionaries to normalize
+            return:
+                Nothing
+        """
+        csv_keys = set()
+        for output in csv_output:
+            csv_keys.update(output)
+
+        for output_dict in csv_output:
+            for key in csv_keys - output_dict.keys():
+                output_dict[key] = "N/A"
 
 
     def _print_csv_output(self, multiple_device_enabled=False, watching_output=False):
+        # Deferred so json/human_readable runs don't pay the csv import
+        import csv
+
         if multiple_device_enabled:
             stored_csv_output = self.multiple_device_output
         else:
@@ -441,20 +539,13 @@ class AMDSMILogger():
                 stored_csv_output = [self.output]
 
         if stored_csv_output:
-            csv_keys = set()
-            for output in stored_csv_output:
-                for key in output:
-                    csv_keys.add(key)
-
-            for index, output_dict in enumerate(stored_csv_output):
-                remaining_keys = csv_keys - set(output_dict.keys())
-                for key in remaining_keys:
-                    stored_csv_output[index][key] = "N/A"
+            self._fill_missing_csv_keys(stored_csv_output)
+            # Get the header as a list of the first element to maintain order;
+            # computed once and reused by the stdout and file paths
+            csv_header = stored_csv_output[0].keys()
 
         if self.destination == 'stdout':
             if stored_csv_output:
-                # Get the header as a list of the first element to maintain order
-                csv_header = stored_csv_output[0].keys()
                 csv_stdout_output = self.CsvStdoutBuilder()
                 writer = csv.DictWriter(csv_stdout_output, csv_header)
                 writer.writeheader()
@@ -462,45 +553,38 @@ class AMDSMILogger():
                 print(str(csv_stdout_output))
         else:
             if watching_output:
-                with self.destination.open('w', newline = '') as output_file:
-                    if self.watch_output:
-                        csv_keys = set()
-                        for output in self.watch_output:
-                            for key in output:
-                                csv_keys.add(key)
-
-                        for index, output_dict in enumerate(self.watch_output):
-                            remaining_keys = csv_keys - set(output_dict.keys())
-                            for key in remaining_keys:
-                                self.watch_output[index][key] = "N/A"
-
-                        # Get the header as a list of the first element to maintain order
-                        csv_header = self.watch_output[0].keys()
-                        writer = csv.DictWriter(output_file, csv_header)
-                        writer.writeheader()
-                        writer.writerows(self.watch_output)
+                output_file = self._get_watch_file(newline='')
+                if self.watch_output:
+                    self._fill_missing_csv_keys(self.watch_output)
+
+                    # Get the header as a list of the first element to maintain order
+                    csv_header = self.watch_output[0].keys()
+                    writer = csv.DictWriter(output_file, csv_header)
+                    writer.writeheader()
+                    writer.writerows(self.watch_output)
+                output_file.flush()
             else:
                 with self.destination.open('a', newline = '') as output_file:
-                    # Get the header as a list of the first element to maintain order
-                    csv_header = stored_csv_output[0].keys()
                     writer = csv.DictWriter(output_file, csv_header)
                     writer.writeheader()
                     writer.writerows(stored_csv_output)
 
 
     def _print_human_readable_output(self, multiple_device_enabled=False, watching_output=False, tabular=False):
-        human_readable_output = ''
+        # Collect per-device segments and join once for the whole batch
+        output_segments = []
         if tabular:
             if self.table_title:
-                human_readable_output += self.table_title + ':\n'
-            human_readable_output += self.table_header + '\n'
+                output_segments.append(self.table_title + ':\n')
+            output_segments.append(self.table_header + '\n')
 
         if multiple_device_enabled:
             for output in self.multiple_device_output:
-                human_readable_output += self._convert_json_to_human_readable(output, tabular=tabular)
-                human_readable_output += '\n'
+                output_segments.append(self._convert_json_to_human_readable(output, tabular=tabular))
+                output_segments.append('\n')
         else:
-            human_readable_output += self._convert_json_to_human_readable(self.output, tabular=tabular)
+            output_segments.append(self._convert_json_to_human_readable(self.output, tabular=tabular))
+        human_readable_output = ''.join(output_segments)
 
         if self.destination == 'stdout':
             try:
@@ -511,17 +595,19 @@ class AMDSMILogger():
                 print(human_readable_output.encode('ascii', 'ignore').decode('ascii'))
         else:
             if watching_output:
-                with self.destination.open('w') as output_file:
-                    human_readable_output = ''
+                output_file = self._get_watch_file()
+                watch_segments = []
+                if tabular:
+                    if self.table_title:
+                        watch_segments.append(self.table_title + '\n')
+                    watch_segments.append(self.table_header + '\n')
+                for output in self.watch_output:
+                    watch_segments.append(self._convert_json_to_human_readable(output, tabular=tabular))
                     if tabular:
-                        if self.table_title:
-                            human_readable_output += self.table_title + '\n'
-                        human_readable_output += self.table_header + '\n'
-                    for output in self.watch_output:
-                        human_readable_output += self._convert_json_to_human_readable(output, tabular=tabular)
-                        if tabular:
-                            human_readable_output += '\n'
-                    output_file.write(human_readable_output + '\n')
+                        watch_segments.append('\n')
+                watch_segments.append('\n')
+                output_file.write(''.join(watch_segments))
+                output_file.flush()
             else:
                 with self.destination.open('a') as output_file:
                     output_file.write(human_readable_output + '\n')